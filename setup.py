@@ -35,6 +35,7 @@ setup(
     packages=[
         "sfp",
     ],
+    python_requires=">=3.9",
     install_requires=[
         "watchdog",
     ],
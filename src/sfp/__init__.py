@@ -1,2 +1,3 @@
 from ._poller import Poller, Parameters, dummy_file_check, dummy_file_processing, simple_logging
 from ._poller import GLOB_NAME_PLACEHOLDER, LOGGING_TYPE_DEBUG, LOGGING_TYPE_INFO, LOGGING_TYPE_ERROR
+from ._poller import WATCHDOG_BACKEND_AUTO, WATCHDOG_BACKEND_INOTIFY, WATCHDOG_BACKEND_POLLING, WATCHDOG_BACKENDS
@@ -1,10 +1,19 @@
+import asyncio
+import collections
+import errno
+import fnmatch
 import glob
+import itertools
 import os
+import queue
+import re
 import shutil
+import threading
 import traceback
-from typing import Callable, List
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable, List
 from datetime import datetime
-from time import sleep
+from time import monotonic_ns, time_ns
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
@@ -12,6 +21,18 @@ from watchdog.events import FileSystemEventHandler
 GLOB_NAME_PLACEHOLDER = "{NAME}"
 """ The glob placeholder for identifying other input files. """
 
+_GLOB_MAGIC = re.compile("[*?[]")
+""" For detecting whether a glob expression contains wildcards. """
+
+_BACKOFF_MIN_WAIT = 0.01
+""" The number of seconds to wait initially after a poll that processed files. """
+
+_STALE_HANDLE_ERRNOS = (errno.ENOENT, errno.ESTALE)
+""" The errors indicating that a directory handle no longer refers to the directory, e.g., after re-creating it. """
+
+_MTIME_GRANULARITY_NS = 2000000000
+""" The coarsest granularity of modification times to expect from a file system (FAT/exFAT: 2 seconds). """
+
 
 def dummy_file_check(fname, poller):
     """
@@ -56,6 +77,12 @@ def dummy_file_processing(fname, output_dir, poller):
     return result
 
 
+WATCHDOG_BACKEND_AUTO = "auto"
+WATCHDOG_BACKEND_INOTIFY = "inotify"
+WATCHDOG_BACKEND_POLLING = "polling"
+WATCHDOG_BACKENDS = [WATCHDOG_BACKEND_AUTO, WATCHDOG_BACKEND_INOTIFY, WATCHDOG_BACKEND_POLLING]
+
+
 LOGGING_TYPE_INFO = 1
 LOGGING_TYPE_DEBUG = 2
 LOGGING_TYPE_ERROR = 3
@@ -74,7 +101,7 @@ def simple_logging(logging_type, *args):
 
 class FileCreatedHandler(FileSystemEventHandler):
     """
-    Monitors only for file creations.
+    Monitors for file creations, files being renamed and files being closed after writing.
     """
 
     def __init__(self, poller):
@@ -93,20 +120,31 @@ class FileCreatedHandler(FileSystemEventHandler):
         :param event: the event
         """
         self.poller.debug("File created...")
-        first = True
-        while self.poller.is_busy:
-            if first:
-                first = False
-                self.poller.debug("Poller busy, waiting...")
-            sleep(0.1)
-        maybe_more_files = True
-        while maybe_more_files:
-            file_list = self.poller.list_files()
-            num_files = len(file_list)
-            if (num_files == 0) or (num_files < self.poller.max_files):
-                maybe_more_files = False
-            if num_files > 0:
-                self.poller.process_files(file_list)
+        self._process()
+
+    def on_moved(self, event):
+        """
+        Gets called when a file gets renamed in the directory.
+
+        :param event: the event
+        """
+        self.poller.debug("File moved...")
+        self._process()
+
+    def on_closed(self, event):
+        """
+        Gets called when a file in the directory gets closed after writing.
+
+        :param event: the event
+        """
+        self.poller.debug("File closed...")
+        self._process()
+
+    def _process(self):
+        """
+        Requests the poller to list and process the files in the directory.
+        """
+        self.poller._trigger()
 
 
 class Parameters(object):
@@ -126,6 +164,7 @@ class Poller(object):
     def __init__(self, input_dir=None, output_dir=None, tmp_dir=None, delete_input=False, continuous=False,
                  max_files=-1, extensions=None, other_input_files=None, delete_other_input_files=False,
                  blacklist_tries=3, poll_wait=1.0, use_watchdog=False, watchdog_check_interval=10.0,
+                 watchdog_backend=WATCHDOG_BACKEND_AUTO, workers=1, async_mode=False,
                  verbose=False, progress=True, output_timestamp=True, output_num_files=False,
                  check_file=None, process_file=None, logging=simple_logging, params=Parameters()):
         """
@@ -156,6 +195,12 @@ class Poller(object):
         :type use_watchdog: bool
         :param watchdog_check_interval: the interval in seconds to perform a simple poll, in case a file creation event got missed
         :type watchdog_check_interval: float
+        :param watchdog_backend: the watchdog observer to use: auto (platform default), inotify (Linux only) or polling (eg for network shares, uses poll_wait as interval)
+        :type watchdog_backend: str
+        :param workers: the number of threads to use for processing the files of a batch in parallel, 1 for sequential processing
+        :type workers: int
+        :param async_mode: whether the poll method should run poll_async in an asyncio event loop
+        :type async_mode: bool
         :param verbose: Whether to be more verbose with the logging output.
         :type verbose: bool
         :param progress: Whether to output progress information on the files being processed.
@@ -187,17 +232,37 @@ class Poller(object):
         self.poll_wait = poll_wait
         self.use_watchdog = use_watchdog
         self.watchdog_check_interval = watchdog_check_interval
+        self.watchdog_backend = watchdog_backend
+        self.workers = workers
+        self.async_mode = async_mode
         self.verbose = verbose
         self.progress = progress
         self.output_timestamp = output_timestamp
         self.output_num_files = output_num_files
-        self.check_file = check_file
-        self.process_file = process_file
-        self.logging = logging
+        self._check_file = check_file
+        self._process_file = process_file
+        self._logging = logging
         self.is_listing_files = False
         self.is_processing_files = False
+        self.current_entry = None
         self.params = params
-        self._blacklist = dict()
+        self._blacklist = collections.Counter()
+        self._ext_suffixes = None
+        self._last_dir_key = None
+        self._other_templates = None
+        self._input_dir_name = None
+        self._input_prefix = None
+        self._output_prefix = None
+        self._input_dfd = None
+        self._output_dfd = None
+        self._pool = None
+        self._threads = set()
+        self._log_lock = threading.RLock()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._wakeup = threading.Event()
+        self._trigger_queue = None
+        self._dispatching = False
         self._observer = None
         self._event_handler = None
         self._stopped = False
@@ -265,6 +330,7 @@ class Poller(object):
     def debug(self, *args):
         """
         Outputs the arguments via 'log' if verbose is enabled.
+        In loops, messages that need formatting should only get formatted if verbose is enabled.
 
         :param args: the debug arguments to output
         """
@@ -296,12 +362,23 @@ class Poller(object):
         :type logging_type: int
         :param args: the arguments to output
         """
-        if self._logging is not None:
+        if self._logging is None:
+            return
+        with self._log_lock:
             if self.output_timestamp:
-                self._logging(logging_type, *("%s - " % str(datetime.now()), *args))
+                self._logging(logging_type, self._timestamp(), *args)
             else:
                 self._logging(logging_type, *args)
 
+    def _timestamp(self):
+        """
+        Generates the timestamp prefix for the log messages.
+
+        :return: the prefix
+        :rtype: str
+        """
+        return str(datetime.now()) + " - "
+
     def keyboard_interrupt(self):
         """
         Prints an error message and stops the polling.
@@ -318,6 +395,9 @@ class Poller(object):
             self._observer.stop()
         self.is_processing_files = False
         self.is_listing_files = False
+        self._idle.set()
+        self._wakeup.set()
+        self._trigger()
 
     @property
     def is_stopped(self):
@@ -339,6 +419,24 @@ class Poller(object):
         """
         return self.is_listing_files or self.is_processing_files
 
+    def _update_idle(self):
+        """
+        Signals threads that are waiting for the poller to become idle, unless still listing or processing files.
+        """
+        if not self.is_busy:
+            self._idle.set()
+
+    def wait_until_idle(self, timeout=None):
+        """
+        Blocks until the poller is neither listing nor processing files.
+
+        :param timeout: the maximum number of seconds to wait, None for no limit
+        :type timeout: float
+        :return: whether the poller is idle
+        :rtype: bool
+        """
+        return self._idle.wait(timeout)
+
     def _check(self):
         """
         For performing checks before starting the polling.
@@ -373,243 +471,573 @@ class Poller(object):
                     raise Exception("All extensions must start with '.' (%s)!" % str(self.extensions))
                 if ext != ext.lower():
                     raise Exception("Extensions must be lower case (%s)!" % str(self.extensions))
+        # a single extension gets matched as plain string, multiple ones as tuple
+        if not self.extensions:
+            self._ext_suffixes = None
+        elif len(self.extensions) == 1:
+            self._ext_suffixes = self.extensions[0]
+        else:
+            self._ext_suffixes = tuple(self.extensions)
+
+        if self.other_input_files is not None:
+            self._other_templates = [x.split(GLOB_NAME_PLACEHOLDER) for x in self.other_input_files]
+        else:
+            self._other_templates = None
 
         if self.use_watchdog and not self.continuous:
             raise Exception("Watchdog only available in continuous mode!")
+        if self.watchdog_backend not in WATCHDOG_BACKENDS:
+            raise Exception("Unknown watchdog backend '%s', available: %s" % (self.watchdog_backend, ", ".join(WATCHDOG_BACKENDS)))
 
-    def list_files(self):
+        if self.workers < 1:
+            raise Exception("At least one worker required: %d" % self.workers)
+
+        # directory handles for moving/deleting files without resolving the full paths each time
+        self.close()
+        self._input_prefix = os.path.join(self.input_dir, "")
+        self._input_dir_name = os.path.dirname(self._input_prefix)
+        self._output_prefix = os.path.join(os.path.normpath(self.output_dir), "")
+        self._open_handles()
+
+    def _open_handles(self):
         """
-        Generates the list of files.
+        Opens the handles for the input and output directories, if the platform supports renaming relative to them.
+        Without handles (e.g., no read permission for a directory), files get moved/deleted using their paths.
+        """
+        if os.rename not in os.supports_dir_fd:
+            return
+        try:
+            input_dfd = os.open(self.input_dir, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+        except OSError as e:
+            self.debug("Failed to open input directory handle, using paths instead: %s" % str(e))
+            return
+        try:
+            output_dfd = os.open(self.output_dir, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+        except OSError as e:
+            os.close(input_dfd)
+            self.debug("Failed to open output directory handle, using paths instead: %s" % str(e))
+            return
+        self._input_dfd = input_dfd
+        self._output_dfd = output_dfd
 
-        :return: list of files
-        :rtype: List[str]
+    def _reopen_stale_handles(self, input_stat):
         """
+        Reopens the directory handles if they no longer refer to the input/output directories,
+        e.g., after the directories got re-created.
 
-        if self.is_stopped:
+        :param input_stat: the current stat result of the input directory
+        :type input_stat: os.stat_result
+        """
+        if self._input_dfd is None:
+            return
+        output_stat = os.stat(self.output_dir)
+        input_fstat = os.fstat(self._input_dfd)
+        output_fstat = os.fstat(self._output_dfd)
+        if ((input_stat.st_dev, input_stat.st_ino) == (input_fstat.st_dev, input_fstat.st_ino)) \
+                and ((output_stat.st_dev, output_stat.st_ino) == (output_fstat.st_dev, output_fstat.st_ino)):
             return
+        self.debug("Input/output directory got replaced, reopening directory handles")
+        self._close_handles()
+        self._open_handles()
 
-        self.is_listing_files = True
-        file_list = []
-        self.debug("Start listing files: %s" % self.input_dir)
+    def close(self):
+        """
+        Releases the directory handles and the thread pool that were obtained when starting the polling.
+        """
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+        self._close_handles()
 
+    def _close_handles(self):
+        """
+        Closes the directory handles.
+        """
+        if self._input_dfd is not None:
+            os.close(self._input_dfd)
+            self._input_dfd = None
+        if self._output_dfd is not None:
+            os.close(self._output_dfd)
+            self._output_dfd = None
+
+    def _move_to_output(self, file_path):
+        """
+        Moves the file into the output directory. Files located directly in the input directory get renamed
+        relative to the directory handles, falling back on the paths if the handles are stale.
+        Falls back on shutil.move when crossing file-system boundaries.
+
+        :param file_path: the file to move
+        :type file_path: str
+        """
+        dir_name, name = os.path.split(file_path)
+        if (self._input_dfd is not None) and (dir_name == self._input_dir_name):
+            try:
+                os.replace(name, name, src_dir_fd=self._input_dfd, dst_dir_fd=self._output_dfd)
+                return
+            except OSError as e:
+                if (e.errno not in _STALE_HANDLE_ERRNOS) and (e.errno != errno.EXDEV):
+                    raise
         try:
-            for file_name in os.listdir(self.input_dir):
+            os.replace(file_path, self._output_prefix + name)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            shutil.move(file_path, self._output_prefix + name)
+
+    def _remove_input(self, file_path):
+        """
+        Deletes the file. Files located directly in the input directory get removed relative to the directory handle,
+        falling back on the path if the handle is stale.
+
+        :param file_path: the file to delete
+        :type file_path: str
+        """
+        dir_name, name = os.path.split(file_path)
+        if (self._input_dfd is not None) and (dir_name == self._input_dir_name):
+            try:
+                os.unlink(name, dir_fd=self._input_dfd)
+                return
+            except OSError as e:
+                if e.errno not in _STALE_HANDLE_ERRNOS:
+                    raise
+        os.remove(file_path)
+
+    def _candidates(self):
+        """
+        Generator for the files in the input directory that can be processed.
+
+        :return: the absolute file names
+        :rtype: Iterator[str]
+        """
+
+        # no need to call the check if it lets all files pass anyway (and has nothing to log)
+        check_file = self.check_file
+        if (check_file is dummy_file_check) and not self.verbose:
+            check_file = None
+        ext_suffixes = self._ext_suffixes
+
+        with os.scandir(self.input_dir) as it:
+            for entry in it:
                 if self.is_stopped:
                     self.info("Stopped")
                     return
 
-                file_path = os.path.join(self.input_dir, file_name)
+                file_name = entry.name
+                file_path = entry.path
 
-                if os.path.isdir(file_path):
+                if entry.is_dir():
                     continue
 
                 # monitored extension?
-                if self.extensions is not None:
-                    ext_lower = os.path.splitext(file_name)[1]
-                    if ext_lower not in self.extensions:
-                        self.debug("%s does not match extensions: %s" % (file_name, str(self.extensions)))
+                if ext_suffixes is not None:
+                    # extensions are lower case, only lower the name if the exact case doesn't match
+                    if not file_name.endswith(ext_suffixes) and not file_name.lower().endswith(ext_suffixes):
+                        if self.verbose:
+                            self.debug("%s does not match extensions: %s" % (file_name, str(self.extensions)))
                         continue
 
                 # file OK?
-                if self.check_file is not None:
-                    ok = self.check_file(file_path, self)
+                if check_file is not None:
+                    self.current_entry = entry
+                    try:
+                        ok = check_file(file_path, self)
+                    finally:
+                        self.current_entry = None
                     if ok:
                         # remove file from blacklist if it could be processed now
-                        if file_path in self._blacklist:
-                            del self._blacklist[file_path]
-                        file_list.append(file_path)
+                        self._blacklist.pop(file_path, None)
+                        yield file_path
                     else:
-                        if file_path not in self._blacklist:
-                            self._blacklist[file_path] = 1
-                        else:
-                            self._blacklist[file_path] = self._blacklist[file_path] + 1
+                        self._blacklist[file_path] += 1
                 else:
-                    file_list.append(file_path)
+                    yield file_path
 
-                # remove files that cannot be processed
-                if len(self._blacklist) > 0:
-                    remove_from_blacklist = []
-                    for k in self._blacklist:
-                        if self._blacklist[k] == self.blacklist_tries:
-                            self.error("%s" % os.path.basename(k))
-                            remove_from_blacklist.append(k)
-                            try:
-                                if self.delete_input:
-                                    self.error("Flagged as incomplete %d times, deleting" % self.blacklist_tries)
-                                    os.remove(k)
-                                else:
-                                    self.error("Flagged as incomplete %d times, skipping" % self.blacklist_tries)
-                                    shutil.move(k, os.path.join(self.output_dir, os.path.basename(k)))
-                            except KeyboardInterrupt:
-                                self.keyboard_interrupt()
-                                return
-                            except:
-                                self.error(traceback.format_exc())
-
-                    for k in remove_from_blacklist:
-                        del self._blacklist[k]
+    def list_files_iter(self):
+        """
+        Generator for the files to process, stops after max_files files (if > 0).
+        Files that failed the check too often get removed once the listing is complete.
+
+        :return: the absolute file names
+        :rtype: Iterator[str]
+        """
+
+        if self.is_stopped:
+            return
+
+        self.is_listing_files = True
+        self._idle.clear()
+        try:
+            # directory unchanged since the last listing that found nothing to do?
+            # (stat the path, as the directory may have been replaced by a new one with the same name)
+            try:
+                dir_stat = os.stat(self.input_dir)
+                self._reopen_stale_handles(dir_stat)
+                dir_key = (dir_stat.st_dev, dir_stat.st_ino, dir_stat.st_mtime_ns)
+            except:
+                dir_stat = None
+                dir_key = None
+            if (dir_key is not None) and (dir_key == self._last_dir_key) and (len(self._blacklist) == 0):
+                self.debug("Input directory unchanged, skipping listing")
+                return
+
+            if self.verbose:
+                self.debug("Start listing files: %s" % self.input_dir)
+
+            candidates = self._candidates()
+            if self.max_files > 0:
+                limited = itertools.islice(candidates, self.max_files)
+            else:
+                limited = candidates
+            num_files = 0
+            try:
+                for file_path in limited:
+                    num_files += 1
+                    yield file_path
+                if self.is_stopped:
+                    return
 
                 # reached limit for poll?
-                if self.max_files > 0:
-                    if len(file_list) == self.max_files:
+                if num_files == self.max_files:
+                    if self.verbose:
                         self.debug("Reached maximum of %d files" % self.max_files)
-                        break
 
-            self.debug("Finished listing files")
+                # remove files that cannot be processed
+                stale = [k for k, v in self._blacklist.items() if v >= self.blacklist_tries]
+                for k in stale:
+                    self.error("%s" % os.path.basename(k))
+                    try:
+                        if self.delete_input:
+                            self.error("Flagged as incomplete %d times, deleting" % self.blacklist_tries)
+                            self._remove_input(k)
+                        else:
+                            self.error("Flagged as incomplete %d times, skipping" % self.blacklist_tries)
+                            self._move_to_output(k)
+                    except KeyboardInterrupt:
+                        self.keyboard_interrupt()
+                        return
+                    except:
+                        self.error(traceback.format_exc())
+                    del self._blacklist[k]
+
+                # only remember modification times that are older than the timestamp granularity of the file system
+                self._last_dir_key = None
+                if (num_files == 0) and (len(self._blacklist) == 0) and (dir_key is not None):
+                    if time_ns() - dir_stat.st_mtime_ns > _MTIME_GRANULARITY_NS:
+                        self._last_dir_key = dir_key
+
+                self.debug("Finished listing files")
+
+            except GeneratorExit:
+                raise
+            except KeyboardInterrupt:
+                self.keyboard_interrupt()
+                return
+            except:
+                self.error("Failed listing files!")
+                self.error(traceback.format_exc())
+            finally:
+                candidates.close()
+        finally:
+            self.is_listing_files = False
+            self._update_idle()
+
+    def list_files(self):
+        """
+        Generates the list of files.
+
+        :return: list of files
+        :rtype: List[str]
+        """
+
+        if self.is_stopped:
+            return
+
+        return list(self.list_files_iter())
+
+    def _find_other_input_files(self, name):
+        """
+        Locates the other input files that belong to the file being processed. Expressions without wildcards
+        are checked directly, all expressions with wildcards get matched in a single pass over the input directory.
+
+        :param name: the name of the file being processed, without path and extension
+        :type name: str
+        :return: the absolute file names of the other input files
+        :rtype: List[str]
+        """
+        result = []
+        matchers = []
+        for other_template in self._other_templates:
+            pattern = name.join(other_template)
+            if (os.sep in pattern) or ((os.altsep is not None) and (os.altsep in pattern)):
+                result.extend(glob.glob(self._input_prefix + pattern))
+            elif _GLOB_MAGIC.search(pattern) is None:
+                other_path = self._input_prefix + pattern
+                if os.path.lexists(other_path):
+                    result.append(other_path)
+            else:
+                # like glob, wildcards only match hidden files if the pattern starts with a dot
+                matchers.append((pattern.startswith("."), re.compile(fnmatch.translate(os.path.normcase(pattern))).match))
+
+        if len(matchers) > 0:
+            with os.scandir(self.input_dir) as it:
+                for entry in it:
+                    entry_name = os.path.normcase(entry.name)
+                    hidden = entry_name.startswith(".")
+                    for allow_hidden, match in matchers:
+                        if (allow_hidden or not hidden) and (match(entry_name) is not None):
+                            result.append(entry.path)
+                            break
+
+        # files can be matched by several expressions, but must only get moved/deleted once
+        return list(dict.fromkeys(result))
+
+    def _process_one(self, file_path, i, num_files):
+        """
+        Processes a single polled file.
+
+        :param file_path: the absolute file name to process
+        :type file_path: str
+        :param i: the 0-based index of the file in the batch
+        :type i: int
+        :param num_files: the number of files in the batch, None if not known
+        :type num_files: int
+        """
+
+        if self.is_stopped:
+            return
+
+        start_ns = monotonic_ns()
+        if self.output_num_files:
+            num_files_str = " %d/%d" % ((i + 1), num_files)
+        else:
+            num_files_str = ""
+        if self.progress:
+            self.info("Start processing%s: %s" % (num_files_str, file_path))
+        try:
+            if self.process_file is not None:
+                if self.tmp_dir is not None:
+                    processed_list = self.process_file(file_path, self.tmp_dir, self)
+                    for processed_path in processed_list:
+                        if self.verbose:
+                            self.debug("Moving processed %s to %s" % (processed_path, self.output_dir))
+                        self._move_to_output(processed_path)
+                else:
+                    self.process_file(file_path, self.output_dir, self)
 
+            # input file
+            if self.delete_input:
+                if self.verbose:
+                    self.debug("Deleting input%s: %s" % (num_files_str, file_path))
+                self._remove_input(file_path)
+            else:
+                if self.verbose:
+                    self.debug("Moving input%s: %s -> %s" % (num_files_str, file_path, self.output_dir))
+                self._move_to_output(file_path)
+
+            # other input files?
+            if self._other_templates is not None:
+                stem = os.path.splitext(os.path.basename(file_path))[0]
+                for other_path in self._find_other_input_files(stem):
+                    if self.delete_other_input_files:
+                        if self.verbose:
+                            self.debug("Deleting other input%s: %s" % (num_files_str, other_path))
+                        self._remove_input(other_path)
+                    else:
+                        if self.verbose:
+                            self.debug("Moving other input%s: %s -> %s" % (num_files_str, other_path, self.output_dir))
+                        self._move_to_output(other_path)
         except KeyboardInterrupt:
             self.keyboard_interrupt()
             return
         except:
-            self.error("Failed listing files!")
+            self.error("Failed processing%s: %s" % (num_files_str, file_path))
             self.error(traceback.format_exc())
 
-        self.is_listing_files = False
-
-        return file_list
+        if self.progress:
+            processing_time = (monotonic_ns() - start_ns) // 1000000
+            self.info("Finished processing%s: %d ms" % (num_files_str, processing_time))
 
-    def process_files(self, file_list: List[str]):
+    def process_files(self, file_list: Iterable[str]):
         """
-        Processes the polled files.
+        Processes the polled files. Uses the thread pool if more than one worker was requested.
 
-        :param file_list: the list of absolute file names to process (strings)
-        :type file_list: list
+        :param file_list: the absolute file names to process (strings), either a list or an iterator like list_files_iter
+        :type file_list: Iterable
+        :return: the number of files that were processed
+        :rtype: int
         """
 
         if self.is_stopped:
-            return
+            return 0
 
         self.is_processing_files = True
-        num_files = len(file_list)
+        self._idle.clear()
+        num_files = 0
+        if self.output_num_files:
+            if not isinstance(file_list, list):
+                file_list = list(file_list)
+            total = len(file_list)
+        else:
+            total = None
 
         try:
-            for i, file_path in enumerate(file_list):
-                if self.is_stopped:
-                    self.error("Stopped")
-                    return
-
-                start_time = datetime.now()
-                if self.output_num_files:
-                    num_files_str = " %d/%d" % ((i + 1), num_files)
-                else:
-                    num_files_str = ""
-                self.info("Start processing%s: %s" % (num_files_str, file_path))
+            if self._pool is None:
+                for i, file_path in enumerate(file_list):
+                    if self.is_stopped:
+                        self.error("Stopped")
+                        return num_files
+                    self._process_one(file_path, i, total)
+                    num_files += 1
+            else:
+                futures = [self._pool.submit(self._process_one, file_path, i, total)
+                           for i, file_path in enumerate(file_list)]
+                num_files = len(futures)
                 try:
-                    if self.process_file is not None:
-                        if self.tmp_dir is not None:
-                            processed_list = self.process_file(file_path, self.tmp_dir, self)
-                            for processed_path in processed_list:
-                                self.debug("Moving processed %s to %s" % (processed_path, self.output_dir))
-                                shutil.move(processed_path, os.path.join(self.output_dir, os.path.basename(processed_path)))
-                        else:
-                            self.process_file(file_path, self.output_dir, self)
-
-                    # input file
-                    if self.delete_input:
-                        self.debug("Deleting input%s: %s" % (num_files_str, file_path))
-                        os.remove(file_path)
-                    else:
-                        self.debug("Moving input%s: %s -> %s" % (num_files_str, file_path, self.output_dir))
-                        shutil.move(file_path, os.path.join(self.output_dir, os.path.basename(file_path)))
-
-                    # other input files?
-                    if self.other_input_files is not None:
-                        for other_input_file in self.other_input_files:
-                            other_files = glob.glob(os.path.join(self.input_dir, other_input_file.replace(GLOB_NAME_PLACEHOLDER, os.path.splitext(file_path)[0])))
-                            for other_file in other_files:
-                                other_path = os.path.join(self.input_dir, other_file)
-                                if self.delete_other_input_files:
-                                    self.debug("Deleting other input%s: %s" % (num_files_str, other_path))
-                                    os.remove(other_path)
-                                else:
-                                    self.debug("Moving other input%s: %s -> %s" % (num_files_str, other_path, self.output_dir))
-                                    shutil.move(other_path, os.path.join(self.output_dir, os.path.basename(other_path)))
-                except KeyboardInterrupt:
-                    self.keyboard_interrupt()
-                    return
-                except:
-                    self.error("Failed processing%s: %s" % (num_files_str, file_path))
-                    self.error(traceback.format_exc())
-
-                end_time = datetime.now()
-                processing_time = end_time - start_time
-                processing_time = int(processing_time.total_seconds() * 1000)
-                self.info("Finished processing%s: %d ms" % (num_files_str, processing_time))
+                    for future in as_completed(futures):
+                        future.result()
+                finally:
+                    for future in futures:
+                        future.cancel()
 
         except KeyboardInterrupt:
             self.keyboard_interrupt()
-            return
+            return num_files
         except:
             self.error("Failed processing files!")
             self.error(traceback.format_exc())
 
         self.is_processing_files = False
+        self._update_idle()
+
+        return num_files
+
+    def process_available_files(self):
+        """
+        Lists and processes files until no more files are available. Only lists the files again if the
+        previous listing was cut short by max_files. Waits for the poller to become idle first.
+        """
+
+        while not self.is_stopped:
+            if self.is_busy:
+                self.debug("Poller busy, waiting...")
+                self.wait_until_idle()
+            num_files = self.process_files(self.list_files_iter())
+            if (num_files == 0) or (self.max_files <= 0) or (num_files < self.max_files):
+                break
 
     def _simple_poll(self):
         """
         Performs simple time-interval based polling.
         """
 
+        # back off exponentially from a short wait (after processing files) up to poll_wait
+        wait = min(_BACKOFF_MIN_WAIT, self.poll_wait)
         while not self.is_stopped:
-            file_list = self.list_files()
-
             # nothing found?
-            if len(file_list) == 0:
+            if self.process_files(self.list_files_iter()) == 0:
                 if self.continuous:
-                    self.debug("Waiting %d seconds before next poll" % self.poll_wait)
-                    sleep(self.poll_wait)
+                    if self.verbose:
+                        self.debug("Waiting %.3f seconds before next poll" % wait)
+                    self._wakeup.wait(wait)
+                    wait = min(wait * 2, self.poll_wait)
                     continue
                 else:
                     self.debug("No files found, exiting")
                 break
+            wait = min(_BACKOFF_MIN_WAIT, self.poll_wait)
 
-            self.process_files(file_list)
+    def _create_observer(self):
+        """
+        Creates the watchdog observer according to the selected backend.
+
+        :return: the observer
+        """
+        if self.watchdog_backend == WATCHDOG_BACKEND_INOTIFY:
+            from watchdog.observers.inotify import InotifyObserver
+            return InotifyObserver()
+        elif self.watchdog_backend == WATCHDOG_BACKEND_POLLING:
+            from watchdog.observers.polling import PollingObserver
+            return PollingObserver(timeout=self.poll_wait)
+        else:
+            return Observer()
+
+    def _trigger(self):
+        """
+        Requests the dispatcher thread to process the available files (watchdog mode only).
+        Requests that arrive while one is still pending get merged into the pending one.
+        """
+        trigger_queue = self._trigger_queue
+        if trigger_queue is None:
+            return
+        try:
+            trigger_queue.put_nowait(True)
+        except queue.Full:
+            pass
+
+    def _dispatch(self):
+        """
+        Processes the available files for each request, until the poller gets stopped.
+        """
+        while True:
+            self._trigger_queue.get()
+            if self.is_stopped or not self._dispatching:
+                break
+            self.process_available_files()
 
     def _watchdog_poll(self):
         """
-        Starts a FileCreatedHandler for the input directory.
+        Starts a FileCreatedHandler for the input directory. File events and the check interval merely
+        request processing, the actual listing/processing happens in a single dispatcher thread.
+        Files already present are processed before the observer gets started.
         """
         self._event_handler = FileCreatedHandler(poller=self)
-        self._observer = Observer()
+        self._observer = self._create_observer()
         self._observer.schedule(self._event_handler, self.input_dir)
+
+        # drain the files present at startup
+        self.info("Initial check")
+        self.process_available_files()
+
+        self._trigger_queue = queue.Queue(maxsize=1)
+        self._dispatching = True
+        dispatcher = threading.Thread(target=self._dispatch, name="sfp-dispatcher")
+        dispatcher.start()
         self._observer.start()
         try:
-            count = 0.0
-            while True:
-                if (count == 0) or (count >= self.watchdog_check_interval):
-                    if count == 0:
-                        self.info("Initial check")
-                    else:
-                        self.info("Watchdog check interval reached")
-                    count = 0.0
-                    maybe_more_files = True
-                    while maybe_more_files:
-                        first = True
-                        while self.is_busy:
-                            if first:
-                                first = False
-                                self.debug("Poller busy, waiting...")
-                            sleep(0.1)
-                        file_list = self.list_files()
-                        num_files = len(file_list)
-                        if (num_files == 0) or (num_files < self.max_files):
-                            maybe_more_files = False
-                        if num_files > 0:
-                            self.process_files(file_list)
-                count += 0.1
-                sleep(0.1)
+            # catch files that arrived between the initial check and starting the observer; this only skips
+            # the listing if the directory's modification time is old enough to be cached (see list_files_iter),
+            # i.e., usually not after processing files during the initial check
+            self._trigger()
+            while not self.is_stopped:
+                self._wakeup.wait(self.watchdog_check_interval)
+                if self.is_stopped:
+                    break
+                self.info("Watchdog check interval reached")
+                self._trigger()
         finally:
             self._observer.stop()
             self._observer.join()
+            # a pending request wakes up the dispatcher as well
+            self._dispatching = False
+            self._trigger()
+            dispatcher.join()
+            self._trigger_queue = None
 
-    def poll(self):
+    def _initialize(self, use_pool=True):
         """
-        Performs the polling.
+        Resets the state, performs the checks and outputs the parameters before starting the polling.
+
+        :param use_pool: whether to create the thread pool for processing files (if more than one worker)
+        :type use_pool: bool
         """
 
         self._stopped = False
+        self._wakeup.clear()
         self._blacklist.clear()
+        self._last_dir_key = None
         self._check()
+        if use_pool and (self.workers > 1):
+            self._pool = ThreadPoolExecutor(max_workers=self.workers)
 
         # output parameters
         self.debug("Polling parameters")
@@ -620,13 +1048,144 @@ class Poller(object):
         if self.extensions is not None:
             self.debug("- Extensions: %s" % str(self.extensions))
         self.debug("- Continuous: %s" % str(self.continuous))
+        self.debug("- Workers: %d" % self.workers)
+        self.debug("- Async: %s" % str(self.async_mode))
         self.debug("- Watchdog: %s" % str(self.use_watchdog))
         if self.use_watchdog:
             self.debug("- Watchdog check interval: %d seconds" % self.watchdog_check_interval)
+            self.debug("- Watchdog backend: %s" % self.watchdog_backend)
         else:
             self.debug("- Poll wait interval: %d seconds" % self.poll_wait)
 
-        if self.use_watchdog:
-            self._watchdog_poll()
-        else:
-            self._simple_poll()
+    def poll(self):
+        """
+        Performs the polling. In async mode, runs poll_async in a new event loop.
+        """
+
+        if self.async_mode:
+            try:
+                asyncio.run(self.poll_async())
+            except KeyboardInterrupt:
+                self.keyboard_interrupt()
+            return
+
+        self._initialize()
+        try:
+            if self.use_watchdog:
+                self._watchdog_poll()
+            else:
+                self._simple_poll()
+        finally:
+            self.close()
+
+    async def _to_thread(self, func, *args):
+        """
+        Runs the function in a separate thread. Cancelling the caller does not abandon the thread,
+        which gets tracked until it finishes (see _wait_for_threads).
+
+        :param func: the function to run
+        :param args: the arguments for the function
+        :return: the result of the function
+        """
+        task = asyncio.ensure_future(asyncio.to_thread(func, *args))
+        self._threads.add(task)
+        task.add_done_callback(self._threads.discard)
+        return await asyncio.shield(task)
+
+    async def _wait_for_threads(self):
+        """
+        Waits for all the threads started via _to_thread to finish, even if getting cancelled again.
+        """
+        while len(self._threads) > 0:
+            try:
+                await asyncio.wait(list(self._threads))
+            except asyncio.CancelledError:
+                pass
+
+    async def _process_one_async(self, semaphore, file_path, i, num_files):
+        """
+        Processes a single polled file in a separate thread, once the semaphore permits it.
+
+        :param semaphore: the semaphore limiting the number of files processed at the same time
+        :type semaphore: asyncio.Semaphore
+        :param file_path: the absolute file name to process
+        :type file_path: str
+        :param i: the 0-based index of the file in the batch
+        :type i: int
+        :param num_files: the number of files in the batch
+        :type num_files: int
+        """
+        async with semaphore:
+            await self._to_thread(self._process_one, file_path, i, num_files)
+
+    async def _process_files_async(self, file_list: List[str]):
+        """
+        Processes the polled files concurrently, each one in a separate thread.
+        At most 'workers' files get processed at the same time.
+
+        :param file_list: the list of absolute file names to process (strings)
+        :type file_list: list
+        """
+
+        if self.is_stopped:
+            return
+
+        self.is_processing_files = True
+        self._idle.clear()
+        num_files = len(file_list)
+        semaphore = asyncio.Semaphore(self.workers)
+        results = await asyncio.gather(
+            *(self._process_one_async(semaphore, file_path, i, num_files) for i, file_path in enumerate(file_list)),
+            return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                self.error("Failed processing files!")
+                self.error("".join(traceback.format_exception(type(result), result, result.__traceback__)))
+        self.is_processing_files = False
+        self._update_idle()
+
+    async def _simple_poll_async(self):
+        """
+        Performs simple time-interval based polling, waiting without blocking the event loop.
+        """
+
+        # back off exponentially from a short wait (after processing files) up to poll_wait
+        wait = min(_BACKOFF_MIN_WAIT, self.poll_wait)
+        while not self.is_stopped:
+            file_list = await self._to_thread(self.list_files)
+
+            # nothing found?
+            if not file_list:
+                if self.continuous:
+                    if self.verbose:
+                        self.debug("Waiting %.3f seconds before next poll" % wait)
+                    await asyncio.sleep(wait)
+                    wait = min(wait * 2, self.poll_wait)
+                    continue
+                else:
+                    self.debug("No files found, exiting")
+                break
+
+            await self._process_files_async(file_list)
+            wait = min(_BACKOFF_MIN_WAIT, self.poll_wait)
+
+    async def poll_async(self):
+        """
+        Performs the polling within the current asyncio event loop, allowing multiple pollers to share a loop.
+        Listing and processing of files happens in threads, with the files of a batch being processed concurrently.
+        Cancelling the polling stops the poller and waits for the threads to finish before releasing the resources.
+        """
+
+        # only the watchdog thread uses the thread pool, simple polling processes the batches via the event loop
+        self._initialize(use_pool=self.use_watchdog)
+        try:
+            if self.use_watchdog:
+                await self._to_thread(self._watchdog_poll)
+            else:
+                await self._simple_poll_async()
+        except (asyncio.CancelledError, KeyboardInterrupt):
+            self.stop()
+            raise
+        finally:
+            await self._wait_for_threads()
+            self.close()